@@ -13,6 +13,7 @@ class Config:
     FRAME_INTERVAL = int(os.getenv('FRAME_INTERVAL', 10))
     UNIQUENESS_TOLERANCE = float(os.getenv('UNIQUENESS_TOLERANCE', 0.5))
     COMPARISON_TOLERANCE = float(os.getenv('COMPARISON_TOLERANCE', 0.6))
+    DUPLICATE_FRAME_THRESHOLD = int(os.getenv('DUPLICATE_FRAME_THRESHOLD', 0))
     
     # Directorios
     OUTPUT_FOLDER = Path(os.getenv('OUTPUT_FOLDER', 'face_captures'))
@@ -26,6 +27,11 @@ class Config:
     # Configuración de procesamiento
     MAX_WORKERS = int(os.getenv('MAX_WORKERS', 4))
     BATCH_SIZE = int(os.getenv('BATCH_SIZE', 100))
+    PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 8))
+    DETECTION_BATCH_SIZE = int(os.getenv('DETECTION_BATCH_SIZE', 8))
+    
+    # Dimensión de las codificaciones faciales de dlib
+    ENCODING_SIZE = 128
     
     # Formatos de imagen soportados
     SUPPORTED_IMAGE_FORMATS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
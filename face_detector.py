@@ -1,16 +1,137 @@
-import face_recognition
-import cv2
-import json
 import logging
+import queue
+import threading
 import numpy as np
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Dict, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor
-from tqdm import tqdm
+from dataclasses import dataclass, asdict
+from functools import lru_cache
 import hashlib
 
 from config import Config
-from utils import setup_logger, validate_video_file, calculate_file_hash
+from utils import (
+    setup_logger, validate_video_file, calculate_file_hash, save_encodings_store,
+    load_encodings_store, warmup_face_detector
+)
+
+if TYPE_CHECKING:
+    import cv2
+
+# FOURCC de códecs sin predicción entre frames (MJPEG, ProRes, DNxHD)
+INTRA_ONLY_CODECS = {
+    'MJPG', 'mjpg', 'MJPA', 'MJPB', 'jpeg',
+    'apco', 'apcs', 'apcn', 'apch', 'ap4h', 'ap4x',
+    'AVdn', 'AVdh',
+}
+
+# Tamaño mínimo (px) que los detectores de dlib encuentran sin sobremuestrear
+DLIB_MIN_DETECTABLE_FACE = 80
+
+
+def _any_within(matrix, target, tolerance_sq):
+    """Indica si alguna fila de matrix está a distancia L2² <= tolerance_sq de target."""
+    for i in range(matrix.shape[0]):
+        total = 0.0
+        for k in range(matrix.shape[1]):
+            d = matrix[i, k] - target[k]
+            total += d * d
+        if total <= tolerance_sq:
+            return True
+    return False
+
+
+@lru_cache(maxsize=None)
+def _compiled_any_within():
+    """Devuelve _any_within compilado con Numba, o None si Numba no está instalado."""
+    try:
+        from numba import njit
+    except ImportError:  # Dependencia opcional: verificación con NumPy
+        return None
+    return njit(cache=True, fastmath=True, boundscheck=False)(_any_within)
+
+
+@dataclass
+class FaceRecord:
+    """Metadatos de un rostro único; su codificación vive en FaceDetector.unique_matrix."""
+    __slots__ = ('id', 'frame', 'timestamp', 'location', 'size', 'quality', 'capture_path')
+    
+    id: int
+    frame: int
+    timestamp: float
+    location: Tuple[int, int, int, int]
+    size: Tuple[int, int]
+    quality: Dict[str, float]
+    capture_path: str
+    
+    @classmethod
+    def from_dict(cls, data: Dict, default_id: int) -> 'FaceRecord':
+        """Construye el registro desde su representación JSON."""
+        return cls(
+            id=data.get('id', default_id),
+            frame=data.get('frame', 0),
+            timestamp=data.get('timestamp', 0.0),
+            location=tuple(data.get('location', ())),
+            size=tuple(data.get('size', ())),
+            quality=data.get('quality', {}),
+            capture_path=data.get('capture_path', '')
+        )
+
+
+class FrameReader(threading.Thread):
+    """
+    Hilo lector: decodifica y prepara frames mientras el hilo principal detecta.
+    
+    Los frames preparados se entregan en orden a través de una cola acotada,
+    por lo que la memoria queda limitada a maxsize frames. Se consume
+    iterando sobre el lector; un error de lectura queda en `error`.
+    """
+    
+    def __init__(self, frames: Iterable[Tuple[int, np.ndarray]],
+                 prepare: Callable[[np.ndarray], Tuple[np.ndarray, Optional[int]]], maxsize: int):
+        super().__init__(name='face-detector-reader', daemon=True)
+        self._frames = frames
+        self._prepare = prepare
+        self._queue: 'queue.Queue[Optional[Tuple[int, np.ndarray, Optional[int]]]]' = queue.Queue(
+            maxsize=maxsize
+        )
+        self._stop_event = threading.Event()
+        self.error: Optional[Exception] = None
+    
+    def _put(self, item) -> bool:
+        """Encola un elemento sin bloquear indefinidamente si el lector se detiene."""
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def run(self):
+        try:
+            for frame_count, frame in self._frames:
+                rgb_frame, frame_hash = self._prepare(frame)
+                if not self._put((frame_count, rgb_frame, frame_hash)):
+                    return
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(None)
+    
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray, Optional[int]]]:
+        """Entrega (número de frame, frame RGB, aHash o None) hasta el final del video."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            yield item
+    
+    def stop(self):
+        """Detiene el lector y espera a que termine."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
 
 
 class FaceDetector:
@@ -21,10 +142,35 @@ class FaceDetector:
         self.config.create_directories()
         self.logger = setup_logger('face_detector', self.config.LOG_FILE)
         self.unique_encodings = []
+        self._set_unique_matrix(np.empty((0, self.config.ENCODING_SIZE), dtype=np.float32))
         self.processed_hashes = set()
+        self._previous_frame_hash: Optional[int] = None
+        self._any_within = _compiled_any_within()
+    
+    def _set_unique_matrix(self, matrix: np.ndarray):
+        """Reemplaza la matriz (N, 128) de codificaciones únicas."""
+        self._unique_buffer = np.array(matrix, dtype=np.float32).reshape(
+            -1, self.config.ENCODING_SIZE
+        )
+        self.unique_matrix = self._unique_buffer
+    
+    def _add_unique_encoding(self, face_encoding: np.ndarray):
+        """Agrega una codificación a la matriz contigua, duplicando la capacidad al crecer."""
+        count = self.unique_matrix.shape[0]
+        if count == self._unique_buffer.shape[0]:
+            capacity = max(64, count * 2)
+            buffer = np.empty((capacity, self.config.ENCODING_SIZE),
+                              dtype=self._unique_buffer.dtype)
+            buffer[:count] = self._unique_buffer[:count]
+            self._unique_buffer = buffer
+        
+        self._unique_buffer[count] = face_encoding
+        self.unique_matrix = self._unique_buffer[:count + 1]
         
     def _resize_frame_if_needed(self, frame: np.ndarray, max_width: int = 1280) -> np.ndarray:
         """Redimensiona el frame si es muy grande para optimizar el procesamiento."""
+        import cv2
+        
         height, width = frame.shape[:2]
         if width > max_width:
             scale = max_width / width
@@ -33,8 +179,11 @@ class FaceDetector:
             return cv2.resize(frame, (new_width, new_height))
         return frame
     
-    def _extract_face_features(self, frame: np.ndarray, face_location: Tuple[int, int, int, int]) -> Optional[Dict]:
-        """Extrae características del rostro y valida su calidad."""
+    def _extract_face_features(self, rgb_frame: np.ndarray,
+                               face_location: Tuple[int, int, int, int]) -> Optional[Dict]:
+        """Extrae características del rostro (frame RGB) y valida su calidad."""
+        import cv2
+        
         top, right, bottom, left = face_location
         width = right - left
         height = bottom - top
@@ -44,12 +193,15 @@ class FaceDetector:
             return None
         
         # Extraer región del rostro
-        face_region = frame[top:bottom, left:right]
+        face_region = rgb_frame[top:bottom, left:right]
         
         # Calcular calidad básica (contraste y nitidez)
-        gray_face = cv2.cvtColor(face_region, cv2.COLOR_BGR2GRAY)
-        contrast = gray_face.std()
-        laplacian_var = cv2.Laplacian(gray_face, cv2.CV_64F).var()
+        # meanStdDev evita temporales de NumPy; el Laplaciano en CV_32F usa la mitad de memoria
+        gray_face = cv2.cvtColor(face_region, cv2.COLOR_RGB2GRAY)
+        _, contrast = cv2.meanStdDev(gray_face)
+        contrast = contrast[0, 0]
+        _, laplacian_std = cv2.meanStdDev(cv2.Laplacian(gray_face, cv2.CV_32F))
+        laplacian_var = laplacian_std[0, 0] ** 2
         
         # Filtrar rostros de baja calidad
         if contrast < 20 or laplacian_var < 50:
@@ -66,21 +218,32 @@ class FaceDetector:
     
     def _is_unique_face(self, face_encoding: np.ndarray) -> bool:
         """Verifica si el rostro es único comparándolo con los ya almacenados."""
-        if not self.unique_encodings:
+        if self.unique_matrix.shape[0] == 0:
             return True
         
-        existing_encodings = [item['encoding_np'] for item in self.unique_encodings]
-        matches = face_recognition.compare_faces(
-            existing_encodings, 
-            face_encoding, 
-            tolerance=self.config.UNIQUENESS_TOLERANCE
-        )
-        return True not in matches
+        tolerance_sq = self.config.UNIQUENESS_TOLERANCE ** 2
+        
+        # Kernel compilado con salida temprana, sin temporales (N, 128)
+        if self._any_within is not None:
+            return not self._any_within(self.unique_matrix, face_encoding, tolerance_sq)
+        
+        # Distancias L2 al cuadrado contra todos los rostros únicos en una sola operación
+        diff = self.unique_matrix - face_encoding
+        distances = np.einsum('ij,ij->i', diff, diff)
+        return not (distances <= tolerance_sq).any()
     
-    def _save_face_capture(self, frame: np.ndarray, face_info: Dict, frame_number: int) -> str:
-        """Guarda la captura del rostro con nombre descriptivo."""
+    def _save_face_capture(self, rgb_frame: np.ndarray, face_info: Dict, frame_number: int,
+                           write_queue: queue.Queue) -> str:
+        """
+        Encola la captura del rostro con nombre descriptivo.
+        
+        La escritura a disco la realiza el hilo escritor del pipeline, de modo
+        que la codificación JPEG no bloquea la detección.
+        """
+        import cv2
+        
         top, right, bottom, left = face_info['location']
-        face_region = frame[top:bottom, left:right]
+        face_region = rgb_frame[top:bottom, left:right]
         
         # Generar nombre único basado en características
         quality_score = int(face_info['quality']['contrast'] + face_info['quality']['sharpness'])
@@ -88,9 +251,221 @@ class FaceDetector:
         filepath = self.config.OUTPUT_FOLDER / filename
         
         # Guardar con mayor calidad
-        cv2.imwrite(str(filepath), face_region, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        write_queue.put((str(filepath), face_region, [cv2.IMWRITE_JPEG_QUALITY, 95]))
         return str(filepath)
     
+    def _prepare_frame(self, frame: np.ndarray) -> Tuple[np.ndarray, Optional[int]]:
+        """Redimensiona y convierte un frame a RGB; devuelve también su aHash, si se usa."""
+        import cv2
+        
+        # Redimensionar frame si es necesario
+        frame = self._resize_frame_if_needed(frame)
+        
+        # Convertir a RGB in situ: solo se mantiene una copia del frame
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+        
+        # El hash solo hace falta si la detección de duplicados está activa
+        if self.config.DUPLICATE_FRAME_THRESHOLD <= 0:
+            return rgb_frame, None
+        return rgb_frame, self._average_hash(rgb_frame)
+    
+    def _writer_worker(self, write_queue: queue.Queue):
+        """Hilo escritor: guarda en disco las capturas encoladas."""
+        import cv2
+        
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+            
+            filepath, face_region, params = item
+            try:
+                # Las regiones llegan en RGB; solo se convierte el recorte
+                bgr_region = cv2.cvtColor(face_region, cv2.COLOR_RGB2BGR)
+                ok, buffer = cv2.imencode('.jpg', bgr_region, params)
+                if not ok:
+                    self.logger.error(f"No se pudo codificar la captura: {filepath}")
+                    continue
+                
+                # Escritura directa del buffer JPEG (admite rutas no ASCII)
+                Path(filepath).write_bytes(buffer.data)
+            except Exception as e:
+                self.logger.error(f"Error guardando captura {filepath}: {e}")
+    
+    @staticmethod
+    def _average_hash(rgb_frame: np.ndarray) -> int:
+        """Calcula el hash perceptual promedio (aHash) de 64 bits de un frame."""
+        import cv2
+        
+        small = cv2.resize(rgb_frame, (8, 8), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        bits = np.packbits(gray > gray.mean())
+        return int.from_bytes(bits.tobytes(), 'big')
+    
+    def _is_duplicate_frame(self, frame_hash: Optional[int]) -> bool:
+        """
+        Indica si el frame es casi idéntico al frame muestreado anterior.
+        
+        Se considera duplicado si la distancia de Hamming entre hashes es menor
+        que DUPLICATE_FRAME_THRESHOLD (0 = desactivado).
+        """
+        threshold = self.config.DUPLICATE_FRAME_THRESHOLD
+        if threshold <= 0 or frame_hash is None:
+            return False
+        
+        previous_hash = self._previous_frame_hash
+        self._previous_frame_hash = frame_hash
+        if previous_hash is None:
+            return False
+        return bin(previous_hash ^ frame_hash).count('1') < threshold
+    
+    def _process_frame_faces(self, frame_count: int, rgb_frame: np.ndarray,
+                             face_locations: List[Tuple[int, int, int, int]], fps: float,
+                             stats: Dict, write_queue: queue.Queue):
+        """Codifica los rostros detectados en un frame y registra los que sean únicos."""
+        import face_recognition
+        
+        if not face_locations:
+            return
+        
+        stats['faces_detected'] += len(face_locations)
+        
+        # Obtener codificaciones de rostros
+        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+        
+        for face_location, face_encoding in zip(face_locations, face_encodings):
+            # dlib entrega float64; float32 basta para distancias L2 y reduce a la mitad la memoria
+            face_encoding = face_encoding.astype(np.float32)
+            
+            # Extraer y validar características del rostro
+            face_info = self._extract_face_features(rgb_frame, face_location)
+            if not face_info:
+                continue
+            
+            # Verificar si es un rostro único
+            if self._is_unique_face(face_encoding):
+                # Guardar captura
+                capture_path = self._save_face_capture(rgb_frame, face_info, frame_count,
+                                                       write_queue)
+                stats['captures_saved'] += 1
+                
+                # Almacenar codificación
+                face_record = FaceRecord(
+                    id=len(self.unique_encodings) + 1,
+                    frame=frame_count,
+                    timestamp=frame_count / fps,
+                    location=face_info['location'],
+                    size=face_info['size'],
+                    quality=face_info['quality'],
+                    capture_path=capture_path
+                )
+                
+                self.unique_encodings.append(face_record)
+                self._add_unique_encoding(face_encoding)
+                stats['unique_faces'] += 1
+    
+    def _upsample_times(self) -> int:
+        """Sobremuestreos necesarios para detectar rostros de MIN_FACE_SIZE (HOG y CNN)."""
+        return 0 if self.config.MIN_FACE_SIZE >= DLIB_MIN_DETECTABLE_FACE else 1
+    
+    def _process_cnn_batch(self, batch: List[Tuple[int, np.ndarray]], fps: float,
+                           stats: Dict, write_queue: queue.Queue, report_progress):
+        """Detecta rostros en un lote de frames con el modelo CNN en una sola llamada."""
+        import face_recognition
+        
+        batch_locations = face_recognition.batch_face_locations(
+            [rgb_frame for _, rgb_frame in batch],
+            number_of_times_to_upsample=self._upsample_times(),
+            batch_size=len(batch)
+        )
+        
+        for (frame_count, rgb_frame), face_locations in zip(batch, batch_locations):
+            self._process_frame_faces(frame_count, rgb_frame, face_locations,
+                                      fps, stats, write_queue)
+            report_progress(frame_count)
+    
+    def _open_video_capture(self, video_path: str) -> 'cv2.VideoCapture':
+        """Abre el video intentando primero la decodificación por hardware de FFmpeg."""
+        import cv2
+        
+        video_capture = None
+        
+        # NVDEC/VAAPI/D3D11 según la plataforma; requiere OpenCV >= 4.5.2
+        if hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+            try:
+                video_capture = cv2.VideoCapture(
+                    str(video_path), cv2.CAP_FFMPEG,
+                    [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+                )
+            except cv2.error as e:
+                self.logger.debug(f"Decodificación por hardware no disponible: {e}")
+                video_capture = None
+            
+            if video_capture is not None and not video_capture.isOpened():
+                video_capture.release()
+                video_capture = None
+        
+        if video_capture is None:
+            video_capture = cv2.VideoCapture(str(video_path))
+        
+        # Minimizar el buffer interno (relevante en streams en vivo)
+        video_capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return video_capture
+    
+    @staticmethod
+    def _is_intra_only(video_capture: 'cv2.VideoCapture') -> bool:
+        """Indica si el códec del video codifica cada frame de forma independiente."""
+        import cv2
+        
+        fourcc = int(video_capture.get(cv2.CAP_PROP_FOURCC))
+        codec = ''.join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4))
+        return codec in INTRA_ONLY_CODECS
+    
+    def _iter_sampled_frames(self, video_capture: 'cv2.VideoCapture'):
+        """
+        Genera los frames muestreados según FRAME_INTERVAL.
+        
+        Yields:
+            Tupla (número de frame, frame BGR)
+        """
+        import cv2
+        
+        interval = max(1, self.config.FRAME_INTERVAL)
+        
+        # Formatos intra-frame: cada frame es independiente y se puede saltar directamente
+        total_frames = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if interval > 1 and total_frames > 0 and self._is_intra_only(video_capture):
+            for frame_index in range(interval - 1, total_frames, interval):
+                video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                ret, frame = video_capture.read()
+                if not ret:
+                    return
+                yield frame_index + 1, frame
+            return
+        
+        frame_count = 0
+        while True:
+            try:
+                # Saltar frames intermedios sin decodificarlos
+                for _ in range(interval - 1):
+                    if not video_capture.grab():
+                        return
+                    frame_count += 1
+                
+                if not video_capture.grab():
+                    return
+                frame_count += 1
+                
+                ret, frame = video_capture.retrieve()
+            except cv2.error as e:
+                self.logger.warning(f"Fin inesperado del stream en el frame {frame_count}: {e}")
+                return
+            
+            if not ret:
+                return
+            
+            yield frame_count, frame
+    
     def process_video(self, video_path: str, progress_callback=None) -> Dict:
         """
         Procesa un video completo extrayendo rostros únicos.
@@ -102,6 +477,10 @@ class FaceDetector:
         Returns:
             Diccionario con estadísticas del procesamiento
         """
+        import cv2
+        import face_recognition
+        from tqdm import tqdm
+        
         video_path = Path(video_path)
         
         # Validaciones iniciales
@@ -110,7 +489,7 @@ class FaceDetector:
         
         self.logger.info(f"Iniciando análisis del video: {video_path}")
         
-        video_capture = cv2.VideoCapture(str(video_path))
+        video_capture = self._open_video_capture(str(video_path))
         if not video_capture.isOpened():
             raise RuntimeError(f"No se pudo abrir el video: {video_path}")
         
@@ -121,6 +500,9 @@ class FaceDetector:
         
         self.logger.info(f"Video cargado - Frames: {total_frames}, FPS: {fps:.2f}, Duración: {duration:.2f}s")
         
+        # La detección de duplicados no compara entre videos distintos
+        self._previous_frame_hash = None
+        
         # Estadísticas
         stats = {
             'total_frames': total_frames,
@@ -128,88 +510,91 @@ class FaceDetector:
             'faces_detected': 0,
             'unique_faces': 0,
             'captures_saved': 0,
+            'duplicate_frames': 0,
             'processing_time': 0
         }
         
-        frame_count = 0
-        
         # Barra de progreso
         pbar = tqdm(total=total_frames // self.config.FRAME_INTERVAL, 
                    desc="Procesando frames", unit="frame")
         
+        # Pipeline: lector (decodificación) -> hilo principal (detección) -> escritor (JPEG)
+        write_queue: 'queue.Queue[Optional[Tuple[str, np.ndarray, List[int]]]]' = queue.Queue(
+            maxsize=self.config.PIPELINE_QUEUE_SIZE
+        )
+        
+        reader = FrameReader(self._iter_sampled_frames(video_capture), self._prepare_frame,
+                             self.config.PIPELINE_QUEUE_SIZE)
+        writer = threading.Thread(
+            target=self._writer_worker, args=(write_queue,),
+            name='face-detector-writer', daemon=True
+        )
+        
+        # Detección por lotes con CNN cuando hay GPU disponible
+        use_cnn = cv2.cuda.getCudaEnabledDeviceCount() > 0
+        warmup_face_detector('cnn' if use_cnn else 'hog')
+        batch_size = max(1, self.config.DETECTION_BATCH_SIZE)
+        pending = []
+        
+        def report_progress(frame_count: int):
+            pbar.update(1)
+            
+            # Callback de progreso
+            if progress_callback:
+                progress = frame_count / total_frames
+                progress_callback(progress, stats)
+        
         try:
             import time
             start_time = time.time()
             
-            while True:
-                ret, frame = video_capture.read()
-                if not ret:
-                    break
+            reader.start()
+            writer.start()
+            
+            for frame_count, rgb_frame, frame_hash in reader:
+                stats['processed_frames'] += 1
                 
-                frame_count += 1
+                # Omitir la detección en frames casi idénticos al frame muestreado anterior
+                if self._is_duplicate_frame(frame_hash):
+                    stats['duplicate_frames'] += 1
+                    report_progress(frame_count)
+                    continue
+                
+                if use_cnn:
+                    # Acumular frames para detección en lote en la GPU
+                    pending.append((frame_count, rgb_frame))
+                    if len(pending) >= batch_size:
+                        self._process_cnn_batch(pending, fps, stats, write_queue, report_progress)
+                        pending = []
+                    continue
                 
-                # Procesar solo frames según el intervalo configurado
-                if frame_count % self.config.FRAME_INTERVAL == 0:
-                    stats['processed_frames'] += 1
-                    
-                    # Redimensionar frame si es necesario
-                    frame = self._resize_frame_if_needed(frame)
-                    
-                    # Convertir a RGB para face_recognition
-                    rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Detectar ubicaciones de rostros
-                    face_locations = face_recognition.face_locations(
-                        rgb_frame, model='cnn' if cv2.cuda.getCudaEnabledDeviceCount() > 0 else 'hog'
-                    )
-                    
-                    if face_locations:
-                        stats['faces_detected'] += len(face_locations)
-                        
-                        # Obtener codificaciones de rostros
-                        face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
-                        
-                        for face_location, face_encoding in zip(face_locations, face_encodings):
-                            # Extraer y validar características del rostro
-                            face_info = self._extract_face_features(frame, face_location)
-                            if not face_info:
-                                continue
-                            
-                            # Verificar si es un rostro único
-                            if self._is_unique_face(face_encoding):
-                                # Guardar captura
-                                capture_path = self._save_face_capture(frame, face_info, frame_count)
-                                stats['captures_saved'] += 1
-                                
-                                # Almacenar codificación
-                                face_data = {
-                                    'id': len(self.unique_encodings) + 1,
-                                    'frame': frame_count,
-                                    'timestamp': frame_count / fps,
-                                    'location': face_info['location'],
-                                    'size': face_info['size'],
-                                    'quality': face_info['quality'],
-                                    'capture_path': capture_path,
-                                    'encoding': face_encoding.tolist(),
-                                    'encoding_np': face_encoding
-                                }
-                                
-                                self.unique_encodings.append(face_data)
-                                stats['unique_faces'] += 1
-                    
-                    pbar.update(1)
-                    
-                    # Callback de progreso
-                    if progress_callback:
-                        progress = frame_count / total_frames
-                        progress_callback(progress, stats)
+                # Detectar ubicaciones de rostros
+                face_locations = face_recognition.face_locations(
+                    rgb_frame, number_of_times_to_upsample=self._upsample_times(), model='hog'
+                )
+                self._process_frame_faces(frame_count, rgb_frame, face_locations,
+                                          fps, stats, write_queue)
+                report_progress(frame_count)
             
-            stats['processing_time'] = time.time() - start_time
+            # Procesar los frames restantes del último lote
+            if pending:
+                self._process_cnn_batch(pending, fps, stats, write_queue, report_progress)
+            
+            if reader.error is not None:
+                self.logger.error(f"Error leyendo frames: {reader.error}")
+                raise RuntimeError(f"Error leyendo el video: {reader.error}")
             
         finally:
+            # Detener el lector y vaciar la cola de escritura antes de liberar recursos
+            reader.stop()
+            if writer.is_alive():
+                write_queue.put(None)
+                writer.join()
             video_capture.release()
             pbar.close()
         
+        stats['processing_time'] = time.time() - start_time
+        
         # Guardar resultados
         self._save_encodings()
         
@@ -217,55 +602,38 @@ class FaceDetector:
         return stats
     
     def _save_encodings(self):
-        """Guarda las codificaciones en archivo JSON."""
-        # Remover arrays numpy para serialización JSON
-        encodings_for_json = []
-        for item in self.unique_encodings:
-            json_item = item.copy()
-            json_item.pop('encoding_np', None)
-            encodings_for_json.append(json_item)
-        
+        """Guarda las codificaciones (.npy) y sus metadatos (JSON)."""
         encodings_file = Path(self.config.ENCODINGS_FILE)
-        with open(encodings_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                'metadata': {
-                    'total_faces': len(encodings_for_json),
-                    'version': '2.0',
-                    'config': {
-                        'min_face_size': self.config.MIN_FACE_SIZE,
-                        'frame_interval': self.config.FRAME_INTERVAL,
-                        'uniqueness_tolerance': self.config.UNIQUENESS_TOLERANCE
-                    }
-                },
-                'faces': encodings_for_json
-            }, f, indent=2)
+        faces = [asdict(record) for record in self.unique_encodings]
+        save_encodings_store(encodings_file, faces, self.unique_matrix, {
+            'config': {
+                'min_face_size': self.config.MIN_FACE_SIZE,
+                'frame_interval': self.config.FRAME_INTERVAL,
+                'uniqueness_tolerance': self.config.UNIQUENESS_TOLERANCE
+            }
+        })
         
         self.logger.info(f"Codificaciones guardadas en: {encodings_file}")
     
     def load_encodings(self, encodings_file: str = None) -> bool:
-        """Carga codificaciones desde archivo JSON."""
+        """Carga codificaciones desde la base de datos de rostros."""
         file_path = Path(encodings_file or self.config.ENCODINGS_FILE)
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # Compatibilidad con formato anterior
-            if 'faces' in data:
-                faces_data = data['faces']
-            else:
-                faces_data = data
+            faces_data, matrix, _ = load_encodings_store(file_path)
             
-            self.unique_encodings = []
-            for item in faces_data:
-                item['encoding_np'] = np.array(item['encoding'])
-                self.unique_encodings.append(item)
+            self.unique_encodings = [
+                FaceRecord.from_dict(item, default_id=i + 1) for i, item in enumerate(faces_data)
+            ]
+            self._set_unique_matrix(matrix)
             
             self.logger.info(f"Cargadas {len(self.unique_encodings)} codificaciones desde {file_path}")
             return True
             
-        except FileNotFoundError:
-            self.logger.warning(f"Archivo de codificaciones no encontrado: {file_path}")
+        except FileNotFoundError as e:
+            # Puede faltar el JSON o la matriz .npy a la que apunta
+            missing_file = e.filename or file_path
+            self.logger.warning(f"Archivo de codificaciones no encontrado: {missing_file}")
             return False
         except Exception as e:
             self.logger.error(f"Error cargando codificaciones: {e}")
@@ -1,14 +1,23 @@
-import face_recognition
-import cv2
-import json
 import numpy as np
 import logging
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 from config import Config
-from utils import setup_logger, validate_image_file
+from utils import setup_logger, validate_image_file, load_encodings_store
+
+
+@lru_cache(maxsize=None)
+def _load_faiss():
+    """Importa FAISS bajo demanda; devuelve None si no está instalado."""
+    try:
+        import faiss
+    except ImportError:  # Dependencia opcional: búsqueda con NumPy
+        return None
+    return faiss
 
 
 @dataclass
@@ -23,45 +32,95 @@ class MatchResult:
     capture_path: str
 
 
+def extract_face_encoding(image_path: str, logger: logging.Logger) -> Optional[np.ndarray]:
+    """Extrae la codificación (float32) del rostro más grande de una imagen."""
+    import face_recognition
+    
+    if not validate_image_file(Path(image_path)):
+        raise ValueError(f"Archivo de imagen inválido: {image_path}")
+    
+    try:
+        # Cargar imagen
+        image = face_recognition.load_image_file(image_path)
+        
+        # Detectar rostros
+        face_locations = face_recognition.face_locations(image, model='hog')
+        
+        if not face_locations:
+            logger.warning("No se detectaron rostros en la imagen")
+            return None
+        
+        if len(face_locations) > 1:
+            logger.warning(f"Se detectaron {len(face_locations)} rostros. Usando el más grande.")
+            # Seleccionar el rostro más grande
+            largest_face = max(face_locations,
+                               key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
+            face_locations = [largest_face]
+        
+        # Obtener codificación
+        face_encodings = face_recognition.face_encodings(image, face_locations)
+        
+        if face_encodings:
+            return face_encodings[0].astype(np.float32)
+        else:
+            logger.error("No se pudo generar codificación del rostro")
+            return None
+            
+    except Exception as e:
+        logger.error(f"Error procesando imagen {image_path}: {e}")
+        return None
+
+
+def _init_encoding_worker(log_file: Path) -> None:
+    """Inicializa cada proceso del pool: con spawn el logger no viene configurado."""
+    setup_logger('face_matcher', log_file, background=False)
+
+
+def _extract_encoding_worker(image_path: str) -> Optional[np.ndarray]:
+    """Punto de entrada para ProcessPoolExecutor (debe ser una función de módulo)."""
+    return extract_face_encoding(image_path, logging.getLogger('face_matcher'))
+
+
 class FaceMatcher:
     """Clase optimizada para comparación de rostros."""
     
     def __init__(self, config: Config = None):
         self.config = config or Config()
         self.logger = setup_logger('face_matcher', self.config.LOG_FILE)
-        self.known_encodings = []
+        self.known_matrix = np.empty((0, self.config.ENCODING_SIZE), dtype=np.float32)
         self.face_data = []
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._index = None
         
     def load_encodings(self, encodings_file: str = None) -> bool:
-        """Carga las codificaciones de rostros desde archivo JSON."""
+        """Carga las codificaciones de rostros desde la base de datos."""
         file_path = Path(encodings_file or self.config.ENCODINGS_FILE)
         
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            faces_data, matrix, metadata = load_encodings_store(file_path)
             
-            # Compatibilidad con diferentes versiones del formato
-            if 'faces' in data:
-                faces_data = data['faces']
-                metadata = data.get('metadata', {})
-                self.logger.info(f"Formato v2.0 detectado - {metadata.get('total_faces', 0)} rostros")
+            version = metadata.get('version', '1.0')
+            if version == '3.0':
+                total_faces = metadata.get('total_faces', 0)
+                self.logger.info(f"Formato v3.0 detectado - {total_faces} rostros")
             else:
-                faces_data = data
-                self.logger.info("Formato v1.0 detectado - convirtiendo...")
+                self.logger.info(f"Formato v{version} detectado - convertido a v3.0")
             
-            self.known_encodings = []
-            self.face_data = []
+            # Matriz contigua (N, 128) para las distancias; los metadatos quedan aparte
+            self.known_matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            self.face_data = list(faces_data)
             
-            for item in faces_data:
-                encoding = np.array(item['encoding'])
-                self.known_encodings.append(encoding)
-                self.face_data.append(item)
+            # ||a - b||² = ||a||² + ||b||² - 2·a·b: las normas se calculan una vez
+            self._sq_norms = np.einsum('ij,ij->i', self.known_matrix, self.known_matrix)
+            self._build_index()
             
-            self.logger.info(f"Cargadas {len(self.known_encodings)} codificaciones desde {file_path}")
+            self.logger.info(f"Cargadas {len(self.face_data)} codificaciones desde {file_path}")
             return True
             
-        except FileNotFoundError:
-            self.logger.error(f"Archivo de codificaciones no encontrado: {file_path}")
+        except FileNotFoundError as e:
+            # Puede faltar el JSON o la matriz .npy a la que apunta
+            missing_file = e.filename or file_path
+            self.logger.error(f"Archivo de codificaciones no encontrado: {missing_file}")
             return False
         except Exception as e:
             self.logger.error(f"Error cargando codificaciones: {e}")
@@ -69,38 +128,147 @@ class FaceMatcher:
     
     def _extract_face_encoding(self, image_path: str) -> Optional[np.ndarray]:
         """Extrae la codificación del rostro de una imagen."""
-        if not validate_image_file(Path(image_path)):
-            raise ValueError(f"Archivo de imagen inválido: {image_path}")
+        return extract_face_encoding(image_path, self.logger)
+    
+    def _extract_target_encodings(self, target_images: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Extrae las codificaciones de varias imágenes en paralelo.
+        
+        La decodificación, detección y codificación de cada imagen son
+        independientes, por lo que se reparten entre MAX_WORKERS procesos.
+        Se usan procesos y no hilos porque dlib no libera el GIL durante la
+        detección y la codificación. Las imágenes que no se pudieron procesar
+        quedan como None.
+        """
+        max_workers = min(self.config.MAX_WORKERS, len(target_images))
+        if max_workers <= 1:
+            futures = None
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_encoding_worker, initargs=(self.config.LOG_FILE,)
+            )
+            futures = [executor.submit(_extract_encoding_worker, path) for path in target_images]
         
+        encodings = []
         try:
-            # Cargar imagen
-            image = face_recognition.load_image_file(image_path)
-            
-            # Detectar rostros
-            face_locations = face_recognition.face_locations(image, model='hog')
-            
-            if not face_locations:
-                self.logger.warning("No se detectaron rostros en la imagen")
-                return None
+            for i, image_path in enumerate(target_images):
+                self.logger.info(f"Procesando: {image_path}")
+                try:
+                    if futures is None:
+                        encoding = self._extract_face_encoding(image_path)
+                    else:
+                        encoding = futures[i].result()
+                except Exception as e:
+                    self.logger.error(f"Error procesando {image_path}: {e}")
+                    encoding = None
+                else:
+                    if encoding is None:
+                        self.logger.error(f"Error procesando {image_path}: "
+                                          "No se pudo procesar la imagen objetivo")
+                encodings.append(encoding)
+        finally:
+            if futures is not None:
+                executor.shutdown()
+        
+        return encodings
+    
+    def _build_index(self):
+        """Construye el índice FAISS sobre las codificaciones conocidas, si está disponible."""
+        self._index = None
+        faiss = _load_faiss()
+        if faiss is None or self.known_matrix.shape[0] == 0:
+            return
+        
+        index = faiss.IndexFlatL2(self.config.ENCODING_SIZE)
+        index.add(np.ascontiguousarray(self.known_matrix, dtype=np.float32))
+        self._index = index
+        self.logger.info(f"Índice FAISS construido con {index.ntotal} codificaciones")
+    
+    def _ensure_encodings_loaded(self):
+        """Carga las codificaciones por defecto si aún no se cargaron."""
+        if not self.face_data:
+            if not self.load_encodings():
+                raise RuntimeError("No se pudieron cargar las codificaciones de rostros")
+    
+    def _nearest(self, targets: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Busca los k rostros conocidos más cercanos a cada codificación objetivo.
+        
+        Args:
+            targets: Matriz (Q, 128) de codificaciones objetivo
+            k: Número de vecinos por objetivo
             
-            if len(face_locations) > 1:
-                self.logger.warning(f"Se detectaron {len(face_locations)} rostros. Usando el más grande.")
-                # Seleccionar el rostro más grande
-                largest_face = max(face_locations, key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
-                face_locations = [largest_face]
+        Returns:
+            Tupla (distancias, índices), ambas de forma (Q, k) y ordenadas
+            de menor a mayor distancia
+        """
+        targets = np.ascontiguousarray(targets, dtype=np.float32).reshape(
+            -1, self.config.ENCODING_SIZE
+        )
+        k = min(k, self.known_matrix.shape[0])
+        
+        if k <= 0:
+            empty = np.empty((targets.shape[0], 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+        
+        if self._index is not None:
+            squared, indices = self._index.search(targets, k)
+            return np.sqrt(np.maximum(squared, 0.0)), indices
+        
+        # Distancias de todos los objetivos a la vez: un único GEMM (sgemm) (Q, N)
+        squared = (
+            self._sq_norms[np.newaxis, :]
+            + np.einsum('ij,ij->i', targets, targets)[:, np.newaxis]
+            - 2.0 * (targets @ self.known_matrix.T)
+        )
+        
+        # Selección sobre las distancias al cuadrado (mismo orden): la raíz
+        # solo se calcula para los k resultados
+        if k == 1:
+            # Mejor coincidencia: un único recorrido O(N)
+            indices = np.argmin(squared, axis=1)[:, np.newaxis]
+        else:
+            # Selección parcial O(N) de los k más cercanos por fila; solo esos se ordenan
+            if k < squared.shape[1]:
+                candidates = np.argpartition(squared, k - 1, axis=1)[:, :k]
+            else:
+                candidates = np.broadcast_to(np.arange(squared.shape[1]), squared.shape)
+            candidate_squared = np.take_along_axis(squared, candidates, axis=1)
+            order = np.argsort(candidate_squared, axis=1, kind='stable')
+            indices = np.take_along_axis(candidates, order, axis=1)
+        
+        indices = indices.astype(np.int64)
+        selected = np.take_along_axis(squared, indices, axis=1)
+        distances = np.sqrt(np.maximum(selected, 0.0)).astype(np.float32)
+        
+        return distances, indices
+    
+    def _build_matches(self, distances: np.ndarray, indices: np.ndarray,
+                       tolerance: float, min_confidence: float) -> List[MatchResult]:
+        """Convierte los vecinos más cercanos (ordenados por distancia) en MatchResult."""
+        results = []
+        for distance, i in zip(distances.tolist(), indices.tolist()):
+            if distance > tolerance:
+                break
             
-            # Obtener codificación
-            face_encodings = face_recognition.face_encodings(image, face_locations)
+            # Calcular confianza normalizada (1 - distancia normalizada)
+            confidence = max(0.0, 1.0 - (distance / tolerance))
+            if confidence < min_confidence:
+                break
             
-            if face_encodings:
-                return face_encodings[0]
-            else:
-                self.logger.error("No se pudo generar codificación del rostro")
-                return None
-                
-        except Exception as e:
-            self.logger.error(f"Error procesando imagen {image_path}: {e}")
-            return None
+            face_info = self.face_data[i]
+            results.append(MatchResult(
+                face_id=face_info.get('id', i + 1),
+                frame=face_info['frame'],
+                timestamp=face_info.get('timestamp', 0),
+                confidence=confidence,
+                location=tuple(face_info['location']),
+                quality=face_info.get('quality', {}),
+                capture_path=face_info.get('capture_path', '')
+            ))
+        
+        return results
     
     def find_matches(self, target_image_path: str, 
                     tolerance: float = None,
@@ -118,9 +286,7 @@ class FaceMatcher:
         Returns:
             Lista de MatchResult ordenada por confianza
         """
-        if not self.known_encodings:
-            if not self.load_encodings():
-                raise RuntimeError("No se pudieron cargar las codificaciones de rostros")
+        self._ensure_encodings_loaded()
         
         # Extraer codificación del rostro objetivo
         target_encoding = self._extract_face_encoding(target_image_path)
@@ -130,33 +296,9 @@ class FaceMatcher:
         tolerance = tolerance or self.config.COMPARISON_TOLERANCE
         self.logger.info(f"Buscando coincidencias con tolerancia: {tolerance}")
         
-        # Calcular distancias con todos los rostros conocidos
-        distances = face_recognition.face_distance(self.known_encodings, target_encoding)
-        
-        # Crear resultados con confianza (1 - distancia normalizada)
-        results = []
-        for i, (distance, face_info) in enumerate(zip(distances, self.face_data)):
-            if distance <= tolerance:
-                # Calcular confianza normalizada
-                confidence = max(0.0, 1.0 - (distance / tolerance))
-                
-                if confidence >= min_confidence:
-                    result = MatchResult(
-                        face_id=face_info.get('id', i + 1),
-                        frame=face_info['frame'],
-                        timestamp=face_info.get('timestamp', 0),
-                        confidence=confidence,
-                        location=tuple(face_info['location']),
-                        quality=face_info.get('quality', {}),
-                        capture_path=face_info.get('capture_path', '')
-                    )
-                    results.append(result)
-        
-        # Ordenar por confianza (descendente)
-        results.sort(key=lambda x: x.confidence, reverse=True)
-        
-        # Limitar resultados
-        results = results[:max_results]
+        # La confianza decrece con la distancia: basta con los max_results más cercanos
+        distances, indices = self._nearest(target_encoding[np.newaxis, :], max_results)
+        results = self._build_matches(distances[0], indices[0], tolerance, min_confidence)
         
         self.logger.info(f"Encontradas {len(results)} coincidencias")
         return results
@@ -167,29 +309,50 @@ class FaceMatcher:
         matches = self.find_matches(target_image_path, tolerance, max_results=1)
         return matches[0] if matches else None
     
-    def batch_compare(self, target_images: List[str], 
-                     tolerance: float = None) -> Dict[str, List[MatchResult]]:
+    def batch_compare(self, target_images: List[str],
+                      tolerance: float = None,
+                      max_results: int = 10,
+                      min_confidence: float = 0.3) -> Dict[str, List[MatchResult]]:
         """
         Compara múltiples imágenes objetivo contra el conjunto de rostros conocidos.
         
+        Las codificaciones objetivo se buscan todas juntas en una sola consulta
+        al índice, en lugar de una búsqueda por imagen.
+        
         Args:
             target_images: Lista de rutas de imágenes objetivo
             tolerance: Tolerancia para la comparación
+            max_results: Número máximo de resultados por imagen
+            min_confidence: Confianza mínima para considerar una coincidencia
             
         Returns:
             Diccionario con resultados por imagen
         """
-        results = {}
+        results: Dict[str, List[MatchResult]] = {image_path: [] for image_path in target_images}
         tolerance = tolerance or self.config.COMPARISON_TOLERANCE
         
-        for image_path in target_images:
-            self.logger.info(f"Procesando: {image_path}")
-            try:
-                matches = self.find_matches(image_path, tolerance)
-                results[image_path] = matches
-            except Exception as e:
-                self.logger.error(f"Error procesando {image_path}: {e}")
-                results[image_path] = []
+        try:
+            self._ensure_encodings_loaded()
+        except RuntimeError as e:
+            self.logger.error(str(e))
+            return results
+        
+        valid_images = []
+        target_encodings = []
+        extracted = self._extract_target_encodings(target_images)
+        for image_path, target_encoding in zip(target_images, extracted):
+            if target_encoding is not None:
+                valid_images.append(image_path)
+                target_encodings.append(target_encoding)
+        
+        if not target_encodings:
+            return results
+        
+        distances, indices = self._nearest(np.stack(target_encodings), max_results)
+        for row, image_path in enumerate(valid_images):
+            results[image_path] = self._build_matches(
+                distances[row], indices[row], tolerance, min_confidence
+            )
         
         return results
     
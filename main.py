@@ -5,15 +5,15 @@ Sistema de análisis de rostros en videos y comparación con imágenes objetivo.
 """
 
 import argparse
+import os
 import sys
-import json
 from pathlib import Path
 from typing import Optional
 
 from config import Config
 from face_detector import FaceDetector
 from face_matcher import FaceMatcher
-from utils import setup_logger, format_time, format_file_size
+from utils import setup_logger, format_time, format_file_size, load_json, save_json
 
 
 def analyze_video(video_path: str, config: Config) -> bool:
@@ -35,6 +35,7 @@ def analyze_video(video_path: str, config: Config) -> bool:
         print(f"    - Rostros detectados: {stats['faces_detected']:,}")
         print(f"    - Rostros únicos: {stats['unique_faces']:,}")
         print(f"    - Capturas guardadas: {stats['captures_saved']:,}")
+        print(f"    - Frames duplicados omitidos: {stats['duplicate_frames']:,}")
         print(f"    - Tiempo de procesamiento: {format_time(stats['processing_time'])}")
         print(f"  📁 Resultados guardados en:")
         print(f"    - Capturas: {config.OUTPUT_FOLDER}")
@@ -82,8 +83,7 @@ def find_person(target_image: str, config: Config,
         report = matcher.generate_match_report(matches, target_image)
         report_file = Path("match_report.json")
         
-        with open(report_file, 'w', encoding='utf-8') as f:
-            json.dump(report, f, indent=2, ensure_ascii=False)
+        save_json(report_file, report)
         
         print(f"\n📄 Reporte detallado guardado en: {report_file}")
         
@@ -101,11 +101,12 @@ def batch_search(target_folder: str, config: Config, tolerance: float = None) ->
         print(f"❌ Carpeta no válida: {target_folder}")
         return False
     
-    # Buscar imágenes en la carpeta
-    image_files = []
-    for ext in config.SUPPORTED_IMAGE_FORMATS:
-        image_files.extend(target_path.glob(f"*{ext}"))
-        image_files.extend(target_path.glob(f"*{ext.upper()}"))
+    # Buscar imágenes en la carpeta (una sola pasada, sin distinguir mayúsculas)
+    with os.scandir(target_path) as entries:
+        image_files = sorted(
+            Path(entry.path) for entry in entries
+            if entry.is_file() and config.validate_file_format(Path(entry.name), 'image')
+        )
     
     if not image_files:
         print(f"❌ No se encontraron imágenes en: {target_folder}")
@@ -116,7 +117,9 @@ def batch_search(target_folder: str, config: Config, tolerance: float = None) ->
     matcher = FaceMatcher(config)
     
     try:
-        results = matcher.batch_compare([str(img) for img in image_files], tolerance)
+        # Nombre de archivo de cada imagen, calculado una sola vez
+        image_names = {str(img): img.name for img in image_files}
+        results = matcher.batch_compare(list(image_names), tolerance)
         
         total_matches = sum(len(matches) for matches in results.values())
         print(f"\n📊 Resultados de búsqueda en lote:")
@@ -134,7 +137,7 @@ def batch_search(target_folder: str, config: Config, tolerance: float = None) ->
         }
         
         for image_path, matches in results.items():
-            image_name = Path(image_path).name
+            image_name = image_names[image_path]
             if matches:
                 print(f"\n  🎯 {image_name}: {len(matches)} coincidencias")
                 best_match = matches[0]
@@ -153,8 +156,7 @@ def batch_search(target_folder: str, config: Config, tolerance: float = None) ->
         
         # Guardar reporte
         report_file = Path("batch_search_report.json")
-        with open(report_file, 'w', encoding='utf-8') as f:
-            json.dump(batch_report, f, indent=2, ensure_ascii=False)
+        save_json(report_file, batch_report)
         
         print(f"\n📄 Reporte de búsqueda en lote guardado en: {report_file}")
         return True
@@ -182,17 +184,30 @@ def show_info(config: Config) -> None:
     encodings_file = Path(config.ENCODINGS_FILE)
     if encodings_file.exists():
         try:
-            with open(encodings_file, 'r') as f:
-                data = json.load(f)
+            data = load_json(encodings_file)
             
             if 'faces' in data:
-                face_count = len(data['faces'])
                 metadata = data.get('metadata', {})
+                face_count = len(data['faces'])
+                total_size = encodings_file.stat().st_size
+                
+                # Formato 3.0: las codificaciones están en un .npy aparte
+                matrix_name = metadata.get('encodings_file')
+                matrix_file = encodings_file.parent / matrix_name if matrix_name else None
+                matrix_exists = False
+                if matrix_file is not None and matrix_file.exists():
+                    matrix_exists = True
+                    total_size += matrix_file.stat().st_size
+                
                 print(f"\n  💾 Base de datos de rostros:")
                 print(f"    - Archivo: {encodings_file}")
+                if matrix_exists:
+                    print(f"    - Matriz: {matrix_file}")
+                elif matrix_file is not None:
+                    print(f"    ⚠️  Matriz no encontrada: {matrix_file}")
                 print(f"    - Rostros almacenados: {face_count}")
                 print(f"    - Versión: {metadata.get('version', 'v1.0')}")
-                print(f"    - Tamaño: {format_file_size(encodings_file.stat().st_size)}")
+                print(f"    - Tamaño: {format_file_size(total_size)}")
             else:
                 face_count = len(data)
                 print(f"\n  💾 Base de datos de rostros (formato v1.0):")
@@ -52,6 +52,21 @@ setup(
         "gpu": [
             "dlib-gpu>=19.24.2",
         ],
+        "ann": [
+            "faiss-cpu>=1.7.4",
+        ],
+        "jit": [
+            "numba>=0.58.1",
+        ],
+        "hash": [
+            "blake3>=0.3.3",
+        ],
+        "json": [
+            "orjson>=3.9.10",
+        ],
+        "vips": [
+            "pyvips>=2.2.1",
+        ],
         "docs": [
             "sphinx>=7.2.6",
             "sphinx-rtd-theme>=1.3.0",
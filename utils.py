@@ -1,15 +1,37 @@
+import os
+import json
+import queue
+import atexit
 import logging
+import logging.handlers
 import hashlib
+import threading
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
-import cv2
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
 from PIL import Image
 
 from config import Config
 
+_warmup_lock = threading.Lock()
+_warmed_detectors: Set[str] = set()
 
-def setup_logger(name: str, log_file: Path, level=logging.INFO) -> logging.Logger:
-    """Configura un logger con archivo y consola."""
+# Caracteres no válidos en nombres de archivo, reemplazados por '_'
+_UNSAFE_FILENAME_CHARS = str.maketrans({c: '_' for c in '<>:"/\\|?*'})
+
+# Configuración usada cuando no se pasa una explícita
+_DEFAULT_CONFIG = Config()
+
+# Listeners de logging en segundo plano: nombre del logger -> (QueueHandler, QueueListener)
+_log_listeners: Dict[
+    str, Tuple[logging.handlers.QueueHandler, logging.handlers.QueueListener]
+] = {}
+
+
+def setup_logger(name: str, log_file: Path, level=logging.INFO,
+                 background: bool = True) -> logging.Logger:
+    """Configura un logger con archivo y consola (en segundo plano si background=True)."""
     logger = logging.getLogger(name)
     logger.setLevel(level)
     
@@ -33,33 +55,255 @@ def setup_logger(name: str, log_file: Path, level=logging.INFO) -> logging.Logge
     console_handler.setLevel(level)
     console_handler.setFormatter(formatter)
     
-    # Add handlers
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if not background:
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
+        return logger
+    
+    # La escritura en disco y consola ocurre en un hilo aparte; el código que
+    # registra solo encola el mensaje
+    log_queue: 'queue.Queue[logging.LogRecord]' = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, console_handler, respect_handler_level=True
+    )
+    listener.start()
+    _log_listeners[name] = (queue_handler, listener)
+    
+    logger.addHandler(queue_handler)
     
     return logger
 
 
-def calculate_file_hash(file_path: Path, chunk_size: int = 8192) -> str:
-    """Calcula el hash MD5 de un archivo."""
-    hash_md5 = hashlib.md5()
+@atexit.register
+def _stop_log_listeners() -> None:
+    """Vacía las colas de logging pendientes al terminar el proceso."""
+    for _, listener in _log_listeners.values():
+        listener.stop()
+    _log_listeners.clear()
+
+
+def _use_direct_log_handlers() -> None:
+    """
+    En un proceso hijo (fork) el hilo del listener no existe: los loggers
+    vuelven a escribir directamente en sus handlers.
+    """
+    for name, (queue_handler, listener) in _log_listeners.items():
+        logger = logging.getLogger(name)
+        logger.removeHandler(queue_handler)
+        for handler in listener.handlers:
+            logger.addHandler(handler)
+    _log_listeners.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_use_direct_log_handlers)
+
+
+def warmup_face_detector(model: str) -> None:
+    """
+    Ejecuta una vez por proceso el detector indicado ('hog' o 'cnn').
+    
+    face_recognition carga los modelos al importarse; la primera inferencia con
+    CNN además inicializa CUDA, lo que aquí ocurre antes del primer lote real.
+    """
+    if model in _warmed_detectors:
+        return
+    
+    with _warmup_lock:
+        if model in _warmed_detectors:
+            return
+        
+        import face_recognition
+        
+        blank = np.zeros((64, 64, 3), dtype=np.uint8)
+        if model == 'cnn':
+            face_recognition.batch_face_locations([blank], batch_size=1)
+        else:
+            face_recognition.face_locations(blank, model=model)
+        _warmed_detectors.add(model)
+
+
+@lru_cache(maxsize=None)
+def _load_blake3():
+    """Importa blake3 bajo demanda; devuelve None si no está instalado."""
+    try:
+        import blake3
+    except ImportError:  # Dependencia opcional: solo para algorithm='blake3'
+        return None
+    return blake3
+
+
+def calculate_file_hash(file_path: Path, algorithm: str = 'sha256',
+                        chunk_size: int = 1 << 20) -> str:
+    """
+    Calcula el hash de un archivo.
+    
+    Args:
+        file_path: Ruta del archivo
+        algorithm: 'blake3' (requiere el paquete blake3) o cualquier algoritmo
+            de hashlib; por defecto SHA-256
+        chunk_size: Tamaño de bloque para la lectura
+        
+    Returns:
+        Digest hexadecimal
+    """
     try:
+        if algorithm == 'blake3':
+            blake3 = _load_blake3()
+            if blake3 is None:
+                raise ImportError("el paquete blake3 no está instalado")
+            hasher = blake3.blake3()
+            hasher.update_mmap(str(file_path))
+            return hasher.hexdigest()
+        
         with open(file_path, "rb") as f:
+            if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+                return hashlib.file_digest(f, algorithm).hexdigest()
+            
+            hasher = hashlib.new(algorithm)
             for chunk in iter(lambda: f.read(chunk_size), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+                hasher.update(chunk)
+            return hasher.hexdigest()
     except Exception as e:
         raise RuntimeError(f"Error calculando hash del archivo {file_path}: {e}")
 
 
+@lru_cache(maxsize=None)
+def _load_orjson():
+    """Importa orjson bajo demanda; devuelve None si no está instalado."""
+    try:
+        import orjson
+    except ImportError:  # Dependencia opcional: se usa el módulo json estándar
+        return None
+    return orjson
+
+
+def load_json(file_path: Path):
+    """Lee un archivo JSON, con orjson si está disponible."""
+    orjson = _load_orjson()
+    if orjson is not None:
+        return orjson.loads(Path(file_path).read_bytes())
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_json(file_path: Path, data) -> None:
+    """Escribe un archivo JSON indentado, con orjson si está disponible."""
+    orjson = _load_orjson()
+    if orjson is not None:
+        Path(file_path).write_bytes(orjson.dumps(
+            data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+        ))
+        return
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def encodings_matrix_path(encodings_file: Path) -> Path:
+    """Ruta del archivo .npy con la matriz de codificaciones asociada al JSON."""
+    return Path(encodings_file).with_suffix('.npy')
+
+
+def save_encodings_store(encodings_file: Path, faces: List[Dict], matrix: np.ndarray,
+                         metadata: Optional[Dict] = None) -> None:
+    """
+    Guarda la base de datos de rostros.
+    
+    Las codificaciones se guardan como matriz binaria (N, 128) float32 en un
+    archivo .npy; el JSON solo contiene los metadatos de cada rostro. Ambos
+    archivos se reemplazan de forma atómica, nunca se sobrescriben en el lugar.
+    """
+    encodings_file = Path(encodings_file)
+    matrix_file = encodings_matrix_path(encodings_file)
+    
+    if len(faces) != len(matrix):
+        raise ValueError(f"Se esperaban {len(faces)} codificaciones, se recibieron {len(matrix)}")
+    
+    metadata = dict(metadata or {})
+    metadata.update({
+        'total_faces': len(faces),
+        'version': '3.0',
+        'encodings_file': matrix_file.name
+    })
+    
+    # Se escribe en archivos temporales y se reemplaza con os.replace: las vistas
+    # mmap abiertas sobre la matriz anterior siguen apuntando al archivo viejo
+    matrix_tmp = matrix_file.with_name(matrix_file.name + '.tmp')
+    encodings_tmp = encodings_file.with_name(encodings_file.name + '.tmp')
+    try:
+        with open(matrix_tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+        save_json(encodings_tmp, {'metadata': metadata, 'faces': faces})
+        
+        os.replace(matrix_tmp, matrix_file)
+        os.replace(encodings_tmp, encodings_file)
+    finally:
+        matrix_tmp.unlink(missing_ok=True)
+        encodings_tmp.unlink(missing_ok=True)
+
+
+def load_encodings_store(encodings_file: Path) -> Tuple[List[Dict], np.ndarray, Dict]:
+    """
+    Carga la base de datos de rostros.
+    
+    La matriz de codificaciones se abre con mmap, sin parsear ni copiar los
+    datos. Los formatos anteriores (v1.0 y v2.0, con las codificaciones dentro
+    del JSON) se migran una única vez al formato actual.
+    
+    Returns:
+        Tupla (metadatos de cada rostro, matriz (N, 128) float32, metadatos
+        del archivo tal como se leyeron)
+    """
+    encodings_file = Path(encodings_file)
+    data = load_json(encodings_file)
+    
+    # Compatibilidad con diferentes versiones del formato
+    if 'faces' in data:
+        faces = data['faces']
+        metadata = data.get('metadata', {})
+    else:
+        faces = data
+        metadata = {}
+    
+    matrix_name = metadata.get('encodings_file')
+    if matrix_name:
+        matrix = np.load(encodings_file.parent / matrix_name, mmap_mode='r')
+        if matrix.shape[0] != len(faces):
+            raise ValueError(f"El archivo {matrix_name} no coincide con {encodings_file}")
+        return faces, matrix, metadata
+    
+    # Formato anterior: codificaciones embebidas en el JSON
+    matrix = np.asarray(
+        [item.pop('encoding') for item in faces], dtype=np.float32
+    ).reshape(-1, Config.ENCODING_SIZE)
+    
+    try:
+        save_encodings_store(encodings_file, faces, matrix, metadata)
+    except OSError:
+        # Sin permisos de escritura: se usa la versión en memoria
+        pass
+    
+    return faces, matrix, metadata
+
+
+@lru_cache(maxsize=256)
+def _is_supported_format(suffix: str, file_type: str) -> bool:
+    """Indica si la extensión está soportada por la configuración por defecto."""
+    return _DEFAULT_CONFIG.validate_file_format(Path('x' + suffix), file_type)
+
+
 def validate_video_file(video_path: Path, config: Config = None) -> bool:
     """Valida que el archivo de video sea accesible y tenga formato válido."""
-    config = config or Config()
+    import cv2
     
     if not video_path.exists():
         return False
     
-    if not config.validate_file_format(video_path, 'video'):
+    if config is None:
+        if not _is_supported_format(video_path.suffix.lower(), 'video'):
+            return False
+    elif not config.validate_file_format(video_path, 'video'):
         return False
     
     # Verificar que OpenCV pueda abrir el archivo
@@ -68,8 +312,8 @@ def validate_video_file(video_path: Path, config: Config = None) -> bool:
         if not cap.isOpened():
             return False
         
-        # Verificar que tenga al menos un frame
-        ret, _ = cap.read()
+        # Verificar que tenga al menos un frame (grab no decodifica)
+        ret = cap.grab()
         cap.release()
         return ret
     except Exception:
@@ -78,28 +322,29 @@ def validate_video_file(video_path: Path, config: Config = None) -> bool:
 
 def validate_image_file(image_path: Path, config: Config = None) -> bool:
     """Valida que el archivo de imagen sea accesible y tenga formato válido."""
-    config = config or Config()
-    
     if not image_path.exists():
         return False
     
-    if not config.validate_file_format(image_path, 'image'):
+    if config is None:
+        if not _is_supported_format(image_path.suffix.lower(), 'image'):
+            return False
+    elif not config.validate_file_format(image_path, 'image'):
         return False
     
-    # Verificar que se pueda abrir la imagen
+    # Verificar la cabecera de la imagen; los píxeles se decodifican después,
+    # al cargarla para la detección
     try:
         with Image.open(image_path) as img:
-            img.verify()
-        return True
+            width, height = img.size
+        return width > 0 and height > 0
     except Exception:
         return False
 
 
 def format_time(seconds: float) -> str:
     """Formatea segundos a formato HH:MM:SS."""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
     
     if hours > 0:
         return f"{hours:02d}:{minutes:02d}:{secs:02d}"
@@ -113,18 +358,41 @@ def format_file_size(size_bytes: int) -> str:
         return "0 B"
     
     size_names = ["B", "KB", "MB", "GB", "TB"]
-    i = 0
-    size = float(size_bytes)
-    
-    while size >= 1024.0 and i < len(size_names) - 1:
-        size /= 1024.0
-        i += 1
+    # Unidad = log2(tamaño) // 10, calculado de forma exacta con bit_length
+    i = min(max(int(abs(size_bytes)).bit_length() - 1, 0) // 10, len(size_names) - 1)
+    size = size_bytes / (1 << (10 * i))
     
     return f"{size:.1f} {size_names[i]}"
 
 
+@lru_cache(maxsize=None)
+def _load_pyvips():
+    """Importa pyvips bajo demanda; devuelve None si no está instalado."""
+    try:
+        import pyvips
+    except (ImportError, OSError):  # Dependencia opcional (requiere libvips): se usa PIL
+        return None
+    return pyvips
+
+
 def create_thumbnail(image_path: Path, output_path: Path, size: tuple = (150, 150)) -> bool:
     """Crea una miniatura de la imagen."""
+    pyvips = _load_pyvips()
+    if pyvips is not None:
+        # libvips reduce la imagen al decodificarla, sin cargarla completa;
+        # no_rotate mantiene la orientación original, igual que PIL
+        try:
+            thumbnail = pyvips.Image.thumbnail(str(image_path), size[0], height=size[1],
+                                               size='down', no_rotate=True)
+            if Path(output_path).suffix.lower() in ('.jpg', '.jpeg'):
+                thumbnail.jpegsave(str(output_path), Q=85, optimize_coding=True)
+            else:
+                thumbnail.write_to_file(str(output_path))
+            return True
+        except pyvips.Error:
+            # Formato no soportado por libvips: se intenta con PIL
+            pass
+    
     try:
         with Image.open(image_path) as img:
             # Mantener proporción
@@ -157,8 +425,7 @@ class ProgressReporter:
 
 def safe_filename(filename: str) -> str:
     """Convierte un string en un nombre de archivo seguro."""
-    import re
     # Remover caracteres no válidos
-    safe_name = re.sub(r'[<>:"/\\|?*]', '_', filename)
+    safe_name = filename.translate(_UNSAFE_FILENAME_CHARS)
     # Limitar longitud
     return safe_name[:100] if len(safe_name) > 100 else safe_name
\ No newline at end of file